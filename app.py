@@ -20,7 +20,8 @@ environment =	{
 props = {
   'APPLICATION_PREFIX': 'sa',
   'GITHUB_REPO_OWNER': 'hanegraaff',
-  'GITHUB_REPO_NAME': 'stock-advisor-software'
+  'GITHUB_REPO_NAME': 'stock-advisor-software',
+  'ENABLE_TASK_PROFILING': False
 }
 
 
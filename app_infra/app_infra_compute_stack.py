@@ -5,6 +5,7 @@ from aws_cdk import (
     aws_ec2 as ec2,
     aws_ssm as ssm,
     aws_ecr as ecr,
+    aws_secretsmanager as secretsmanager,
     aws_iam as iam,
     aws_logs as logs,
     aws_ecs_patterns as ecs_patterns,
@@ -34,9 +35,13 @@ class AppInfraComputeStack(core.Stack):
 
         '''
             ECR Repo
+            The base image repo holds the Python runtime and dependencies
+            shared by both services, whose images are built on top of it.
         '''
+        self.repo_base_image = self.make_ecr_repo("base-image", "Shared Base Image")
         self.repo_recommendation_service = self.make_ecr_repo("recommendation-service", "Recommendation Service")
         self.rep_portfolio_manager = self.make_ecr_repo("portfolio-manager-service", "Portfolio Manager Service")
+        self.repo_profiling_sidecar = self.make_ecr_repo("profiling-sidecar", "Profiling Sidecar")
 
         '''
             IAM Role and Policy used by Fargate to execute task
@@ -102,23 +107,29 @@ class AppInfraComputeStack(core.Stack):
 
 
         '''
-            Parameter Store variables:
+            Application Secrets, stored as a single Secrets Manager JSON secret
+            so that each task fetches them in one call at startup:
             Intrinio API Key
-            TDAMeritrade Client ID and Refresh Token
+            TDAMeritrade Account ID, Client ID and Refresh Token
         '''
-        intrinio_api_key_name = 'INTRINIO_API_KEY'
-        self.intrinio_api_key_param = self.make_ssm_parameter(intrinio_api_key_name, 'put_api_key_here', 'API Key used to access Intrinio financial data')
-        
-        td_ameritrade_account_id_name = 'TDAMERITRADE_ACCOUNT_ID'
-        self.tdameritrade_account_id = self.make_ssm_parameter(td_ameritrade_account_id_name, 'put_account_id_here', 'The TDAmeritrade Account ID')
-        
+        self.app_secret_keys = [
+            'INTRINIO_API_KEY',
+            'TDAMERITRADE_ACCOUNT_ID',
+            'TDAMERITRADE_CLIENT_ID',
+            'TDAMERITRADE_REFRESH_TOKEN'
+        ]
+        self.app_secrets = self.make_secret_bundle('APPLICATION_SECRETS', 'Intrinio API Key and TDAmeritrade credentials used by the application')
 
-        td_ameritrade_client_id_name = 'TDAMERITRADE_CLIENT_ID'
-        self.tdameritrade_client_id = self.make_ssm_parameter(td_ameritrade_client_id_name, 'put_client_id_here', 'The Client Key used to authenticate the application')
-        
-        
-        td_ameritrade_refresh_token_name = 'TDAMERITRADE_REFRESH_TOKEN'
-        self.tdameritrade_refresh_token = self.make_ssm_parameter(td_ameritrade_refresh_token_name, 'put_refresh_token_here', 'OAuth refresh token used to generate temporary Access Keys')
+        '''
+            Legacy Parameter Store variables, replaced by the secret above and
+            retained so that removing them in a future release leaves the live
+            values in place. Do not change their values or descriptions, otherwise
+            CloudFormation will overwrite the live values with these placeholders.
+        '''
+        self.make_ssm_parameter('INTRINIO_API_KEY', 'put_api_key_here', 'API Key used to access Intrinio financial data', core.RemovalPolicy.RETAIN)
+        self.make_ssm_parameter('TDAMERITRADE_ACCOUNT_ID', 'put_account_id_here', 'The TDAmeritrade Account ID', core.RemovalPolicy.RETAIN)
+        self.make_ssm_parameter('TDAMERITRADE_CLIENT_ID', 'put_client_id_here', 'The Client Key used to authenticate the application', core.RemovalPolicy.RETAIN)
+        self.make_ssm_parameter('TDAMERITRADE_REFRESH_TOKEN', 'put_refresh_token_here', 'OAuth refresh token used to generate temporary Access Keys', core.RemovalPolicy.RETAIN)
 
 
         '''
@@ -133,9 +144,10 @@ class AppInfraComputeStack(core.Stack):
             self.repo_recommendation_service,
             "/ecs/recommendation-service",
             ['-app_namespace', self.APPLICATION_PREFIX],
-            {intrinio_api_key_name: ecs.Secret.from_ssm_parameter(self.intrinio_api_key_param)},
+            self.get_bundled_secrets(self.app_secrets, self.app_secret_keys, ['INTRINIO_API_KEY']),
             "Recommendation service monthly scheduled task",
-            "cron(0 10 ? * MON-FRI *)"
+            "cron(0 10 ? * MON-FRI *)",
+            self.props.get('ENABLE_TASK_PROFILING', False)
         )
 
         self.make_fargate_scheduled_task( 
@@ -144,28 +156,26 @@ class AppInfraComputeStack(core.Stack):
             self.rep_portfolio_manager,
             "/ecs/portfolio-manager",
             ['-app_namespace', self.APPLICATION_PREFIX, "-portfolio_size", "3"],
-            {
-                intrinio_api_key_name: ecs.Secret.from_ssm_parameter(self.intrinio_api_key_param),
-                td_ameritrade_account_id_name: ecs.Secret.from_ssm_parameter(self.tdameritrade_account_id),
-                td_ameritrade_client_id_name: ecs.Secret.from_ssm_parameter(self.tdameritrade_client_id),
-                td_ameritrade_refresh_token_name: ecs.Secret.from_ssm_parameter(self.tdameritrade_refresh_token)
-            },
+            self.get_bundled_secrets(self.app_secrets, self.app_secret_keys, self.app_secret_keys),
             "Portfolio Manager daily task",
-            "cron(0 15 ? * MON-FRI *)"
+            "cron(0 15 ? * MON-FRI *)",
+            self.props.get('ENABLE_TASK_PROFILING', False)
         )
 
 
         '''
             Outputs
         '''
+        self.output_props['repo_base_image'] = self.repo_base_image
         self.output_props['repo_recommendation_service']= self.repo_recommendation_service
         self.output_props['repo_portfolio_manager'] = self.rep_portfolio_manager
+        self.output_props['repo_profiling_sidecar'] = self.repo_profiling_sidecar
     
     @property
     def outputs(self):
         return self.output_props
 
-    def make_ssm_parameter(self, base_param_name : str, param_value : str, description : str):
+    def make_ssm_parameter(self, base_param_name : str, param_value : str, description : str, removal_policy : object = None):
         '''
             Creates and tags an SSM Parameter
 
@@ -177,6 +187,8 @@ class AppInfraComputeStack(core.Stack):
                 parameter value
             description : str
                 parameter description 
+            removal_policy : object
+                Optional core.RemovalPolicy applied to the parameter
         '''
 
         param = ssm.StringParameter(
@@ -186,8 +198,73 @@ class AppInfraComputeStack(core.Stack):
         )
         util.tag_resource(param, base_param_name, description)
 
+        if removal_policy is not None:
+            param.apply_removal_policy(removal_policy)
+
         return param
 
+    def make_secret_bundle(self, base_secret_name : str, description : str):
+        '''
+            Creates and tags a Secrets Manager secret grouping related values
+            into a single JSON document. Containers reference individual values
+            by their JSON key (see get_bundled_secrets), so that a task
+            fetches the whole group once at startup.
+
+            Secrets Manager is used rather than a SecureString parameter,
+            since the latter cannot be created by CloudFormation.
+
+            The secret is created with an empty JSON document, and its value is
+            maintained outside of CloudFormation. The template value never
+            changes, so adding keys does not overwrite the live secret.
+
+            Parameters
+            ----------
+            base_secret_name : str
+                The base secret name, wihtout the application namespace prefix
+            description : str
+                secret description
+        '''
+
+        cfn_secret = secretsmanager.CfnSecret(
+            self, base_secret_name, name="%s_%s" % (self.APPLICATION_PREFIX.upper(), base_secret_name),
+            secret_string="{}", description=description
+        )
+        util.tag_resource(cfn_secret, base_secret_name, description)
+
+        return secretsmanager.Secret.from_secret_arn(self, "%s-ref" % base_secret_name, cfn_secret.ref)
+
+    def get_bundled_secrets(self, secret : object, bundle_keys : list, secret_keys : list):
+        '''
+            Returns the container secrets for a list of keys stored in a
+            secret bundle. The keys are validated at synth time so that a task
+            cannot reference a secret that does not exist.
+
+            Parameters
+            ----------
+            secret : object
+                A secret bundle created with make_secret_bundle
+            bundle_keys : list
+                The JSON keys expected in the secret bundle
+            secret_keys : list
+                The JSON keys to inject. They are also used as the names of
+                the container environment variables
+
+            Returns
+            -------
+            A dictionary of ecs.Secret objects indexed by key
+
+            Raises
+            ------
+            ValueError
+                If any of the keys is not part of the secret bundle
+        '''
+
+        missing_keys = [key for key in secret_keys if key not in bundle_keys]
+        if len(missing_keys) > 0:
+            raise ValueError("Secret bundle does not contain: %s" % ", ".join(missing_keys))
+
+        return {key: ecs.Secret.from_secrets_manager(secret, field=key) for key in secret_keys}
+
 
     def make_ecr_repo(self, repo_suffix : str, repo_description : str):
         '''
@@ -217,7 +294,8 @@ class AppInfraComputeStack(core.Stack):
             container_commands : list,
             container_secrets : dict,
             scheduled_task_description : str,
-            scheduled_task_cron_expression : str
+            scheduled_task_cron_expression : str,
+            enable_profiling : bool = False
         ):
 
         '''
@@ -241,6 +319,11 @@ class AppInfraComputeStack(core.Stack):
                 Description used for tags
             scheduled_task_cron_expression : str
                 Task schedule's chron expresion
+            enable_profiling : bool
+                When True, attaches a profiling sidecar that samples the
+                main container's Python process and uploads the resulting
+                profiles to the data bucket under:
+                profiles/APPLICATION_PREFIX-scheduled_task_name/<task id>
         '''
 
         task_definition_name = "%s-%s-task-definition" % (self.APPLICATION_PREFIX, scheduled_task_name)
@@ -249,23 +332,32 @@ class AppInfraComputeStack(core.Stack):
             execution_role=self.ecs_task_exec_role, family=None, task_role=self.props['ecs_task_role'],
         )
 
-        fargate_task.add_container(
+        log_group = logs.LogGroup(
+            self, "%s-%s-cloudwatch-loggroup" % (self.APPLICATION_PREFIX, scheduled_task_name),
+            log_group_name="%s%s" % (self.APPLICATION_PREFIX, cloudwatch_loggroup_name),
+            retention=logs.RetentionDays.ONE_MONTH,
+            removal_policy=core.RemovalPolicy.DESTROY
+        )
+
+        main_container = fargate_task.add_container(
             "%s-%s-container" % (self.APPLICATION_PREFIX, scheduled_task_name), 
             image=ecs.ContainerImage.from_ecr_repository(task_ecr_repo, "latest"),
             logging=ecs.LogDriver.aws_logs(
                 stream_prefix=self.APPLICATION_PREFIX,
-                log_group=logs.LogGroup(
-                    self, "%s-%s-cloudwatch-loggroup" % (self.APPLICATION_PREFIX, scheduled_task_name),
-                    log_group_name="%s%s" % (self.APPLICATION_PREFIX, cloudwatch_loggroup_name),
-                    retention=logs.RetentionDays.ONE_MONTH,
-                    removal_policy=core.RemovalPolicy.DESTROY
-                )
+                log_group=log_group
             ),
             command=container_commands,
             secrets=container_secrets
         )
+
+        if enable_profiling:
+            self.add_profiling_sidecar(fargate_task, main_container, scheduled_task_name, log_group)
+
         util.tag_resource(fargate_task, task_definition_name, task_definition_description)
 
+        # The profiling sidecar's shared PID namespace requires platform version 1.4.0
+        platform_version = ecs.FargatePlatformVersion.VERSION1_4 if enable_profiling else None
+
         scheduled_task_name = "%s-%s-scheduled-task" % (self.APPLICATION_PREFIX, scheduled_task_name)
         ecs_sched_task = ecs_patterns.ScheduledFargateTask(
             self, scheduled_task_name,
@@ -275,7 +367,73 @@ class AppInfraComputeStack(core.Stack):
             schedule=asg.Schedule.expression(scheduled_task_cron_expression),
             cluster=self.props['ecs_fargate_task_cluster'],
             vpc=self.props['ecs_fargate_task_cluster'],
-            subnet_selection=ec2.SubnetSelection(subnet_type=ec2.SubnetType(ec2.SubnetType.PUBLIC))
+            subnet_selection=ec2.SubnetSelection(subnet_type=ec2.SubnetType(ec2.SubnetType.PUBLIC)),
+            platform_version=platform_version
         )
 
         util.tag_resource(ecs_sched_task, scheduled_task_name, scheduled_task_description)
+
+
+    def add_profiling_sidecar(
+            self,
+            fargate_task : object,
+            main_container : object,
+            scheduled_task_name : str,
+            log_group : object
+        ):
+        '''
+            Adds a non essential profiling container to a Fargate Task definition.
+            The task's PID namespace is shared between containers, allowing the
+            sidecar to sample the main container's Python process. Once that
+            process exits, ECS stops the task and the sidecar must upload the
+            speedscope profile and the peak RSS summary to the data bucket when
+            it receives SIGTERM, within the container's stop timeout.
+
+            The scheduled task must run on platform version 1.4.0 or later,
+            see make_fargate_scheduled_task.
+
+            Parameters
+            ----------
+            fargate_task : object
+                The Fargate Task definition being profiled
+            main_container : object
+                The container running the Python process being profiled
+            scheduled_task_name : str
+                The name of the contsruct being profiled. Used to form the names
+                of the sidecar resources and the S3 profile prefix
+            log_group : object
+                Log group shared with the main container
+        '''
+
+        # Not exposed by FargateTaskDefinition
+        fargate_task.node.default_child.add_property_override("PidMode", "task")
+
+        linux_parameters = ecs.LinuxParameters(
+            self, "%s-%s-profiler-linux-parameters" % (self.APPLICATION_PREFIX, scheduled_task_name)
+        )
+        linux_parameters.add_capabilities(ecs.Capability.SYS_PTRACE)
+
+        profiler_container = fargate_task.add_container(
+            "%s-%s-profiler-container" % (self.APPLICATION_PREFIX, scheduled_task_name),
+            image=ecs.ContainerImage.from_ecr_repository(self.repo_profiling_sidecar, "latest"),
+            essential=False,
+            # Maximum allowed by Fargate, leaves time to upload after SIGTERM
+            stop_timeout=core.Duration.seconds(120),
+            memory_reservation_mib=128,
+            linux_parameters=linux_parameters,
+            logging=ecs.LogDriver.aws_logs(
+                stream_prefix="%s-profiler" % self.APPLICATION_PREFIX,
+                log_group=log_group
+            ),
+            environment={
+                'PROFILE_TARGET_PROCESS': 'python',
+                'PROFILE_OUTPUT_FORMAT': 'speedscope',
+                'PROFILE_S3_BUCKET': core.Fn.import_value("%s-data-bucket-name" % self.APPLICATION_PREFIX),
+                'PROFILE_S3_PREFIX': "profiles/%s-%s" % (self.APPLICATION_PREFIX, scheduled_task_name)
+            }
+        )
+
+        profiler_container.add_container_dependencies(ecs.ContainerDependency(
+            container=main_container,
+            condition=ecs.ContainerDependencyCondition.START
+        ))
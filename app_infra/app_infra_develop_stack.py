@@ -3,6 +3,7 @@
 from aws_cdk import (
     aws_iam as iam,
     aws_codebuild as codebuild,
+    aws_events_targets as targets,
     core
 )
 
@@ -60,7 +61,9 @@ class AppInfraDevelopmentStack(core.Stack):
                 "ecr:UploadLayerPart",
                 "ecr:CompleteLayerUpload",
                 "ecr:BatchCheckLayerAvailability",
-                "ecr:PutImage"
+                "ecr:PutImage",
+                "ecr:BatchGetImage",
+                "ecr:GetDownloadUrlForLayer"
             ], conditions=None, effect=iam.Effect.ALLOW, resources=["arn:aws:ecr:%s:repository/*" % r_a_prefix]
         ))
 
@@ -71,28 +74,67 @@ class AppInfraDevelopmentStack(core.Stack):
             role_name=exec_role_name)
 
         '''
-            CodeBuild build project
+            CodeBuild build projects
+
+            The base image project builds the image shared by both services,
+            and a successful build triggers the two service builds, which
+            only add their own layers on top of it.
         '''
-        self.make_codebuild_project(
+        base_image_repo_uri = props['repo_base_image'].repository_uri
+
+        base_image_project = self.make_codebuild_project(
+            "base-image-project",
+            "Project used to build the shared base image",
+            "config/buildspec-base-image.yml",
+            {
+                'BASE_IMAGE_REPO_URI': codebuild.BuildEnvironmentVariable(
+                    value=base_image_repo_uri)
+            }
+        )
+
+        recommendation_service_project = self.make_codebuild_project(
             "recommendation-service-project", 
             "Project used to build the Recommendation Service",
             "config/buildspec-recommendation-svc.yml",
             {
+                'BASE_IMAGE_REPO_URI': codebuild.BuildEnvironmentVariable(
+                    value=base_image_repo_uri),
                 'RECOMMENDATION_SERVICE_REPO_URI': codebuild.BuildEnvironmentVariable(
                     value=props['repo_recommendation_service'].repository_uri)
             }
         )
 
-        self.make_codebuild_project(
+        portfolio_manager_project = self.make_codebuild_project(
             "portfolio-manager-project", 
             "Project used to build the Portfolio Manager",
             "config/buildspec-portfolio-manager.yml",
             {
+                'BASE_IMAGE_REPO_URI': codebuild.BuildEnvironmentVariable(
+                    value=base_image_repo_uri),
                 'PORTFOLIOMGR_SERVICE_REPO_URI': codebuild.BuildEnvironmentVariable(
                     value=props['repo_portfolio_manager'].repository_uri)
             }
         )
 
+        self.make_codebuild_project(
+            "profiling-sidecar-project",
+            "Project used to build the Profiling Sidecar",
+            "config/buildspec-profiling-sidecar.yml",
+            {
+                'PROFILING_SIDECAR_REPO_URI': codebuild.BuildEnvironmentVariable(
+                    value=props['repo_profiling_sidecar'].repository_uri)
+            }
+        )
+
+        base_image_project.on_build_succeeded(
+            "%s-base-image-triggers-recommendation-service" % self.APPLICATION_PREFIX,
+            target=targets.CodeBuildProject(recommendation_service_project)
+        )
+        base_image_project.on_build_succeeded(
+            "%s-base-image-triggers-portfolio-manager" % self.APPLICATION_PREFIX,
+            target=targets.CodeBuildProject(portfolio_manager_project)
+        )
+
     @property
     def outputs(self):
         return self.output_props
@@ -116,6 +158,10 @@ class AppInfraDevelopmentStack(core.Stack):
                 the path the buildspec used to build this project
             env_variables : str
                 The environment variables supplued to the project, e.g. the ECR epo URI
+
+            Returns
+            -------
+            The codebuild project
         '''
 
         project_name = "%s-%s" % (self.APPLICATION_PREFIX, project_suffix)
@@ -133,4 +179,4 @@ class AppInfraDevelopmentStack(core.Stack):
 
         util.tag_resource(build_project, project_name, description)
 
-        
\ No newline at end of file
+        return build_project
@@ -28,8 +28,10 @@ setuptools.setup(
         "aws-cdk.aws_ecs",
         "aws-cdk.aws_ecs_patterns",
         "aws-cdk.aws_ecr",
+        "aws-cdk.aws_secretsmanager",
         "aws-cdk.aws_sns",
-        "aws-cdk.aws_codebuild"
+        "aws-cdk.aws_codebuild",
+        "aws-cdk.aws_events_targets"
     ],
 
     python_requires=">=3.6",
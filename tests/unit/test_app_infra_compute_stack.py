@@ -0,0 +1,54 @@
+import pytest
+
+from aws_cdk import core
+from aws_cdk.core import Aws
+from app_infra.app_infra_base_stack import AppInfraBaseStack
+from app_infra.app_infra_compute_stack import AppInfraComputeStack
+
+environment =	{
+  "region": "us-east-1",
+  "account": Aws.ACCOUNT_ID
+}
+
+props = {
+  'APPLICATION_PREFIX': 'sa'
+}
+
+def get_compute_stack(app):
+    base = AppInfraBaseStack(app, "app-infra-base", props, env=environment)
+    return AppInfraComputeStack(app, "app-infra-compute", base.outputs, env=environment)
+
+def get_template():
+    app = core.App()
+    get_compute_stack(app)
+
+    return app.synth().get_stack("app-infra-compute").template
+
+
+def test_bundled_secrets_unknown_key():
+    compute = get_compute_stack(core.App())
+
+    with pytest.raises(ValueError):
+        compute.get_bundled_secrets(compute.app_secrets, compute.app_secret_keys, ['UNKNOWN_KEY'])
+
+
+def test_bundled_secrets_value_from_json_key():
+    template = get_template()
+
+    value_from_list = []
+    for resource in template['Resources'].values():
+        if resource['Type'] != 'AWS::ECS::TaskDefinition':
+            continue
+        for container in resource['Properties']['ContainerDefinitions']:
+            for secret in container.get('Secrets', []):
+                if secret['Name'] == 'INTRINIO_API_KEY':
+                    value_from_list.append(secret['ValueFrom'])
+
+    # one for each task definition
+    assert(len(value_from_list) == 2)
+
+    for value_from in value_from_list:
+        # The secret ARN is a token, so ValueFrom is rendered as a Fn::Join
+        if isinstance(value_from, dict):
+            value_from = value_from['Fn::Join'][1][-1]
+        assert(value_from.endswith(':INTRINIO_API_KEY::'))